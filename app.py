@@ -1,6 +1,8 @@
 import streamlit as st
 import pandas as pd
 from datetime import datetime
+import hashlib
+import logging
 import sys
 from pathlib import Path
 
@@ -11,34 +13,116 @@ from utils.config_manager import ConfigManager, get_modelo_info
 from utils.excel_reader import (
     leer_hoja_excel, extraer_datos_excel, 
     leer_hoja_calculos, obtener_hojas_disponibles,
-    parse_int
+    CopiaTemporal, EXCEL_ENGINE
 )
-# Asumiendo que pdf_generator.py tendrá la función generar_pdf_hsps refactorizada
-from utils.pdf_generator import generar_pdf_hsps
+
+logger = logging.getLogger(__name__)
 
 # -----------------------
 # Inicialización
 # -----------------------
+_SESSION_DEFAULTS = {
+    'uploaded': False,
+    'config_manager': None,
+    'modelo_seleccionado': None,
+    'registros': None,
+    'df_registros': None,
+    'columnas_detectadas': None,
+    'datos_calculos': None,
+    'datos_comercio': None,
+    'excel_file_id': None,
+    'excel_temporal': None,
+    'pdf_clave': None,
+    'pdf_bytes': None,
+    # Valores por defecto con fecha/hora: se fijan al abrir el paso y se reinician por documento
+    'fecha_envio_default': None,
+    'marca_tiempo': None,
+    'debug': False
+}
+
 def init_session_state():
-    """Inicializa variables de sesión"""
-    defaults = {
-        'uploaded': False,
-        'config_manager': None,
-        'modelo_seleccionado': None,
-        'registros': None,
-        'columnas_detectadas': None,
-        'datos_calculos': None,
-        'datos_comercio': None
-    }
-    
-    for key, value in defaults.items():
-        if key not in st.session_state:
-            st.session_state[key] = value
+    """Inicializa variables de sesión (una sola vez por sesión)"""
+    if 'sesion_iniciada' in st.session_state:
+        return
+    
+    st.session_state.update({k: v for k, v in _SESSION_DEFAULTS.items() if k not in st.session_state})
+    st.session_state.sesion_iniciada = True
+
+def reiniciar_fechas_por_defecto():
+    """Descarta la fecha de envío y la marca del nombre del PDF; solo al cambiar el Excel subido"""
+    st.session_state.fecha_envio_default = None
+    st.session_state.marca_tiempo = None
+
+CONFIG_PATH = Path("config/models.json")
 
 @st.cache_resource
-def cargar_config_manager():
-    """Carga el gestor de configuraciones (cacheado)"""
-    return ConfigManager("config/models.json")
+def cargar_config_manager(mtime: float):
+    """Carga el gestor de configuraciones (cacheado hasta que cambie el mtime del archivo)"""
+    return ConfigManager(str(CONFIG_PATH))
+
+def config_mtime() -> float:
+    """mtime de models.json (0 si no existe); un solo stat por rerun"""
+    try:
+        return CONFIG_PATH.stat().st_mtime
+    except OSError:
+        return 0.0
+
+# Las cachés se indexan por file_id del upload (la ruta con "_" no entra en la clave) y
+# guardan pocas entradas: cada upload es una clave nueva y sin límite crecerían sin fin
+@st.cache_data(show_spinner=False, max_entries=32)
+def listar_hojas(file_id: str, _ruta: str):
+    """Obtiene las hojas del Excel (cacheado por archivo subido)"""
+    return obtener_hojas_disponibles(_ruta)
+
+@st.cache_data(show_spinner=False, max_entries=16)
+def procesar_excel(file_id: str, _ruta: str, hoja_datos, buscar_en_filas, detener_en, columnas_config,
+                   hoja_calculos=None, calculos_cfg=None):
+    """
+    Lee la hoja de datos y, si se indica, la de cálculos abriendo el Excel una sola vez
+    (cacheado por archivo subido y configuración)
+    """
+    with pd.ExcelFile(_ruta, engine=EXCEL_ENGINE) as xlsx:
+        df = leer_hoja_excel(
+            xlsx,
+            hoja_datos,
+            buscar_en_filas=buscar_en_filas,
+            detener_en=detener_en
+        )
+        registros, columnas_detectadas = extraer_datos_excel(df, columnas_config)
+        
+        datos_calculos = {}
+        if hoja_calculos and calculos_cfg:
+            datos_calculos = leer_hoja_calculos(xlsx, hoja_calculos, calculos_cfg)
+    
+    return len(df), registros, columnas_detectadas, datos_calculos
+
+def ruta_excel_subido(archivo) -> str:
+    """
+    Copia el Excel subido a disco una sola vez por upload y devuelve su ruta
+    
+    Las cachés usan el file_id del upload como clave, así no se copian ni se
+    hashean los bytes del archivo en cada rerun. La copia vive en
+    session_state: se borra al subir otro archivo, al vaciar el uploader o
+    cuando Streamlit libera la sesión.
+    """
+    if st.session_state.excel_file_id != archivo.file_id:
+        liberar_excel_subido()
+        reiniciar_fechas_por_defecto()
+        st.session_state.excel_temporal = CopiaTemporal(archivo)
+        st.session_state.excel_file_id = archivo.file_id
+    return st.session_state.excel_temporal.ruta
+
+def liberar_excel_subido():
+    """Elimina la copia en disco del último Excel subido, si existe"""
+    if st.session_state.excel_temporal is not None:
+        st.session_state.excel_temporal.cerrar()
+    st.session_state.excel_temporal = None
+    st.session_state.excel_file_id = None
+
+def clave_pdf(registros, datos_comercio, pdf_cfg, tabla_rapida=False) -> str:
+    """Hash de las entradas del PDF para reutilizar el último documento generado"""
+    contenido = repr((registros, sorted(datos_comercio.items()), pdf_cfg, tabla_rapida))
+    return hashlib.blake2b(contenido.encode('utf-8'), digest_size=16).hexdigest()
 
 # -----------------------
 # UI Principal
@@ -52,9 +136,8 @@ def main():
     
     init_session_state()
     
-    # Cargar configuración
-    if st.session_state.config_manager is None:
-        st.session_state.config_manager = cargar_config_manager()
+    # Cargar configuración (se recarga si models.json cambió en disco)
+    st.session_state.config_manager = cargar_config_manager(config_mtime())
     
     config_mgr = st.session_state.config_manager
     
@@ -72,10 +155,12 @@ def main():
             st.error("❌ No hay modelos configurados en models.json")
             st.stop()
         
+        # Nombres descriptivos calculados una vez por rerun
+        nombres_modelos = {m: get_modelo_info(config_mgr, m) for m in modelos_disponibles}
         modelo = st.selectbox(
             "Selecciona el modelo:",
             modelos_disponibles,
-            format_func=lambda x: get_modelo_info(config_mgr, x)
+            format_func=nombres_modelos.get
         )
         
         st.session_state.modelo_seleccionado = modelo
@@ -157,10 +242,16 @@ def paso_1_subir_excel(config_mgr: ConfigManager, modelo: str):
     
     archivo = st.file_uploader("Selecciona el archivo Excel", type=['xlsx', 'xls'])
     
+    if archivo is None:
+        # Uploader vacío (archivo quitado o paso recién abierto): la copia ya no se usa
+        liberar_excel_subido()
+    
     if archivo:
         try:
+            ruta = ruta_excel_subido(archivo)
+            
             # Obtener hojas disponibles
-            hojas_disponibles = obtener_hojas_disponibles(archivo)
+            hojas_disponibles = listar_hojas(archivo.file_id, ruta)
             st.success(f"✅ Excel cargado. Hojas disponibles: {', '.join(hojas_disponibles)}")
             
             # Selección de hoja de datos
@@ -202,22 +293,29 @@ def paso_1_subir_excel(config_mgr: ConfigManager, modelo: str):
             # Botón para procesar
             if st.button("🔄 Procesar Excel", type="primary", use_container_width=True):
                 with st.spinner("Procesando Excel..."):
-                    # Leer hoja de datos
-                    df = leer_hoja_excel(
-                        archivo,
+                    calculos_cfg = None
+                    if hoja_calculos != "Ninguna":
+                        calculos_cfg = config_mgr.get_calculos_config(modelo)
+                    
+                    # Leer hojas de datos y cálculos (un solo ExcelFile, cacheado por archivo)
+                    total_filas, registros, columnas_detectadas, datos_calculos = procesar_excel(
+                        archivo.file_id,
+                        ruta,
                         hoja_datos,
-                        buscar_en_filas=excel_cfg.get('buscar_header_en_filas', 5),
-                        detener_en=excel_cfg.get('detener_en', ["TOTAL GENERAL"])
+                        excel_cfg.get('buscar_header_en_filas', 5),
+                        excel_cfg.get('detener_en', ["TOTAL GENERAL"]),
+                        excel_cfg.get('columnas', {}),
+                        hoja_calculos if calculos_cfg else None,
+                        calculos_cfg
                     )
                     
-                    st.success(f"✅ Hoja '{hoja_datos}' cargada: {len(df)} filas")
-                    
-                    # Extraer datos
-                    columnas_config = excel_cfg.get('columnas', {})
-                    registros, columnas_detectadas = extraer_datos_excel(df, columnas_config)
+                    st.success(f"✅ Hoja '{hoja_datos}' cargada: {total_filas} filas")
                     
                     st.subheader(f"📊 {len(registros)} registros detectados")
                     
+                    # DataFrame de vista previa: se construye una vez y se reutiliza en el Paso 3
+                    df_registros = pd.DataFrame(registros)
+                    
                     # Mostrar columnas detectadas
                     with st.expander("🔍 Columnas detectadas"):
                         col1, col2, col3 = st.columns(3)
@@ -231,28 +329,22 @@ def paso_1_subir_excel(config_mgr: ConfigManager, modelo: str):
                     
                     # Vista previa de datos
                     with st.expander("👁️ Vista previa de registros"):
-                        df_preview = pd.DataFrame(registros)
-                        st.dataframe(df_preview, use_container_width=True)
+                        st.dataframe(df_registros, use_container_width=True)
                     
-                    # Leer hoja de cálculos
-                    datos_calculos = {}
-                    if hoja_calculos != "Ninguna":
-                        calculos_cfg = config_mgr.get_calculos_config(modelo)
-                        if calculos_cfg:
-                            datos_calculos = leer_hoja_calculos(archivo, hoja_calculos, calculos_cfg)
-                            
-                            if any(datos_calculos.values()):
-                                st.success("✅ Datos de cálculos extraídos:")
-                                col1, col2, col3 = st.columns(3)
-                                with col1:
-                                    st.metric("Peso Neto", datos_calculos.get('net_weight', '-'))
-                                with col2:
-                                    st.metric("Peso Bruto", datos_calculos.get('gross_weight', '-'))
-                                with col3:
-                                    st.metric("Dimensiones", datos_calculos.get('dimensions', '-'))
+                    # Datos de la hoja de cálculos
+                    if any(datos_calculos.values()):
+                        st.success("✅ Datos de cálculos extraídos:")
+                        col1, col2, col3 = st.columns(3)
+                        with col1:
+                            st.metric("Peso Neto", datos_calculos.get('net_weight', '-'))
+                        with col2:
+                            st.metric("Peso Bruto", datos_calculos.get('gross_weight', '-'))
+                        with col3:
+                            st.metric("Dimensiones", datos_calculos.get('dimensions', '-'))
                     
-                    # Guardar en sesión
+                    # Guardar en sesión (todas las claves juntas, solo si el paso terminó bien)
                     st.session_state.registros = registros
+                    st.session_state.df_registros = df_registros
                     st.session_state.columnas_detectadas = columnas_detectadas
                     st.session_state.datos_calculos = datos_calculos
                     st.session_state.uploaded = True
@@ -261,7 +353,9 @@ def paso_1_subir_excel(config_mgr: ConfigManager, modelo: str):
         
         except Exception as e:
             st.error(f"❌ Error procesando Excel: {e}")
-            st.exception(e)
+            logger.exception("Error procesando Excel")
+            if st.session_state.debug:
+                st.exception(e)
 
 # -----------------------
 # PASO 2: Datos Comercio
@@ -286,12 +380,16 @@ def paso_2_datos_comercio(config_mgr: ConfigManager, modelo: str):
     
     st.info("📋 Completa los datos adicionales (valores por defecto cargados desde configuración)")
     
+    # Fecha fijada la primera vez que se muestra el paso, estable entre reruns
+    if st.session_state.fecha_envio_default is None:
+        st.session_state.fecha_envio_default = datetime.now().date()
+    
     with st.form("comercio"):
         st.subheader("📦 Información de envío")
         col1, col2, col3 = st.columns(3)
         
         with col1:
-            shipping_date = st.date_input("Shipping date", value=datetime.now())
+            shipping_date = st.date_input("Shipping date", value=st.session_state.fecha_envio_default)
         with col2:
             seal_no = st.text_input("Seal No.", value=defaults.get('seal_no', 'N/A'))
         with col3:
@@ -401,64 +499,76 @@ def paso_3_generar_pdf(config_mgr: ConfigManager, modelo: str):
     
     st.header("Paso 3: Generar PDF")
     
+    # Import diferido: ReportLab solo se carga cuando se usa el Paso 3
+    from utils.pdf_generator import generar_pdf_hsps, calcular_totales
+    
     registros = st.session_state.registros
     datos_comercio = st.session_state.datos_comercio
     
-    # Calcular totales
-    pallets_unicos = set()
-    total_piezas = 0
-    total_cajas = 0
+    # DataFrame construido una sola vez al procesar el Excel en el Paso 1
+    if st.session_state.df_registros is None:
+        st.session_state.df_registros = pd.DataFrame(registros)
+    df_registros = st.session_state.df_registros
     
-    for reg in registros:
-        if reg.get('numero_pallet'):
-            pallets_unicos.add(reg['numero_pallet'])
-        total_piezas += parse_int(reg.get('cantidad', 0))
-        total_cajas += parse_int(reg.get('total_cajas', 0))
+    # Calcular totales
+    totales = calcular_totales(df_registros)
     
     # Métricas
     col1, col2, col3, col4 = st.columns(4)
     with col1:
         st.metric("📋 Registros", len(registros))
     with col2:
-        st.metric("📦 Total Pallets", len(pallets_unicos))
+        st.metric("📦 Total Pallets", totales['total_pallets'])
     with col3:
-        st.metric("🔢 Total Piezas", total_piezas)
+        st.metric("🔢 Total Piezas", totales['total_piezas'])
     with col4:
-        st.metric("📦 Total Cajas", total_cajas)
+        st.metric("📦 Total Cajas", totales['total_cajas'])
     
     # Vista previa
     with st.expander("👁️ Vista previa de registros"):
-        df_preview = pd.DataFrame(registros)
-        st.dataframe(df_preview, use_container_width=True)
+        st.dataframe(df_registros, use_container_width=True)
     
     with st.expander("📋 Vista previa de datos comerciales"):
         st.json(datos_comercio)
     
     st.divider()
     
-    # Nombre del archivo
+    # Nombre del archivo (marca fijada al mostrar el paso; se renueva tras cada PDF generado)
+    if st.session_state.marca_tiempo is None:
+        st.session_state.marca_tiempo = datetime.now().strftime('%Y%m%d_%H%M')
     nombre_archivo = st.text_input(
         "Nombre del archivo PDF",
-        value=f"PackingList_{modelo}_{datetime.now().strftime('%Y%m%d_%H%M')}",
+        value=f"PackingList_{modelo}_{st.session_state.marca_tiempo}",
         help="Sin extensión .pdf"
     )
     
+    tabla_rapida = st.toggle(
+        "⚡ Tabla de productos rápida",
+        value=False,
+        help="Dibuja la tabla de productos sin ajuste automático de celdas (el texto largo se recorta); recomendado para archivos grandes"
+    )
+    
     col1, col2, col3 = st.columns([1, 1, 1])
     with col2:
         generar_btn = st.button("🚀 Generar PDF", type="primary", use_container_width=True)
     
     if generar_btn:
         try:
-            with st.spinner("Generando PDF en formato HSPS..."):
-                # Generar PDF
-                buffer = generar_pdf_hsps(registros, datos_comercio, config_mgr, modelo)
+            clave = clave_pdf(registros, datos_comercio, config_mgr.get_pdf_config(modelo), tabla_rapida)
+            if st.session_state.pdf_clave != clave:
+                with st.spinner("Generando PDF en formato HSPS..."):
+                    # Generar PDF
+                    buffer = generar_pdf_hsps(df_registros, datos_comercio, config_mgr, modelo,
+                                              tabla_rapida=tabla_rapida)
+                st.session_state.pdf_bytes = buffer.getvalue()
+                st.session_state.pdf_clave = clave
             
             st.success("✅ PDF generado exitosamente!")
 
             # Botón de descarga
             st.download_button(
                 label="⬇️ Descargar Packing List PDF",
-                data=buffer.getvalue(),
+                data=st.session_state.pdf_bytes,
                 file_name=f"{nombre_archivo}.pdf",
                 mime="application/pdf",
                 use_container_width=True,
@@ -467,7 +577,9 @@ def paso_3_generar_pdf(config_mgr: ConfigManager, modelo: str):
             
         except Exception as e:
             st.error(f"❌ Error generando PDF: {e}")
-            st.exception(e)
+            logger.exception("Error generando PDF")
+            if st.session_state.debug:
+                st.exception(e)
 
 # -----------------------
 # GESTIONAR MODELOS
@@ -481,6 +593,7 @@ def gestionar_modelos(config_mgr: ConfigManager):
         st.subheader("Modelos Configurados")
         
         modelos = config_mgr.get_models(activos_solo=False)
+        validaciones = config_mgr.validate_all()
         
         for modelo in modelos:
             with st.expander(f"📦 {modelo}"):
@@ -492,7 +605,7 @@ def gestionar_modelos(config_mgr: ConfigManager):
                     st.write(f"**Nombre completo:** {model_cfg.get('nombre_completo', '-')}")
                     st.write(f"**Activo:** {'✅ Sí' if model_cfg.get('activo', True) else '❌ No'}")
                     
-                    es_valido, errores = config_mgr.validate_model(modelo)
+                    es_valido, errores = validaciones[modelo]
                     if es_valido:
                         st.success("✅ Configuración válida")
                     else:
@@ -503,6 +616,7 @@ def gestionar_modelos(config_mgr: ConfigManager):
                 with col2:
                     if st.button(f"🗑️ Eliminar", key=f"del_{modelo}"):
                         if config_mgr.delete_model(modelo):
+                            cargar_config_manager.clear()
                             st.success(f"✅ Modelo '{modelo}' eliminado")
                             st.rerun()
                         else:
@@ -536,6 +650,7 @@ def gestionar_modelos(config_mgr: ConfigManager):
             
             if uploaded and st.button("📥 Importar", key="btn_import"):
                 if config_mgr.import_model(uploaded):
+                    cargar_config_manager.clear()
                     st.success("✅ Modelo importado correctamente")
                     st.rerun()
                 else:
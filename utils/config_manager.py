@@ -1,32 +1,92 @@
 import json
-from typing import Dict, List, Optional
+import logging
+import os
+import threading
+from typing import Dict, List, Optional, Tuple
 from pathlib import Path
 
+logger = logging.getLogger(__name__)
+
+# orjson (opcional) decodifica/codifica JSON más rápido; ambas variantes producen bytes UTF-8
+try:
+    import orjson
+    _json_loads = orjson.loads
+    
+    def _json_dumps(datos) -> bytes:
+        return orjson.dumps(datos, option=orjson.OPT_INDENT_2)
+except ImportError:
+    _json_loads = json.loads
+    
+    def _json_dumps(datos) -> bytes:
+        return json.dumps(datos, indent=2, ensure_ascii=False).encode('utf-8')
+
+def _escribir_json(ruta: Path, datos):
+    """Escribe el JSON en un archivo hermano .tmp y lo reemplaza de forma atómica"""
+    tmp = ruta.with_suffix(ruta.suffix + '.tmp')
+    try:
+        tmp.write_bytes(_json_dumps(datos))
+        os.replace(tmp, ruta)
+    except BaseException:
+        tmp.unlink(missing_ok=True)
+        raise
+
+# Configuraciones ya parseadas por ruta: (mtime_ns, tamaño, dict); se reutilizan mientras
+# el archivo no cambie. El dict es compartido entre instancias: tratarlo como solo lectura
+_CONFIG_CACHE: Dict[str, Tuple[int, int, Dict]] = {}
+
+# Secciones que todo modelo debe tener para poder usarse
+_SECCIONES_REQUERIDAS = frozenset({'excel', 'pdf'})
+
 class ConfigManager:
     """Gestor de configuraciones de modelos desde JSON"""
     
     def __init__(self, config_path: str = "config/models.json"):
         self.config_path = Path(config_path)
         self.config = self._load_config()
+        self._indexar()
     
     def _load_config(self) -> Dict:
-        """Carga la configuración desde el archivo JSON"""
+        """Carga la configuración desde el archivo JSON (cacheada por mtime y tamaño)"""
         try:
             if self.config_path.exists():
-                with open(self.config_path, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+                clave = str(self.config_path.resolve())
+                stat = self.config_path.stat()
+                cache = _CONFIG_CACHE.get(clave)
+                if cache and cache[:2] == (stat.st_mtime_ns, stat.st_size):
+                    return cache[2]
+                config = _json_loads(self.config_path.read_bytes())
+                _CONFIG_CACHE[clave] = (stat.st_mtime_ns, stat.st_size, config)
+                return config
             else:
-                print(f"Archivo {self.config_path} no encontrado")
+                logger.warning("Archivo %s no encontrado", self.config_path)
                 return {}
-        except Exception as e:
-            print(f"Error cargando configuración: {e}")
+        except Exception:
+            logger.exception("Error cargando configuración")
             return {}
     
+    def recargar(self):
+        """Vuelve a leer el archivo (sin costo si no cambió) y reconstruye los índices"""
+        self.config = self._load_config()
+        self._indexar()
+    
+    def _indexar(self):
+        """Precalcula las vistas por modelo para que los getters sean búsquedas directas"""
+        self._modelos_todos = list(self.config.keys())
+        # Las entradas que no son dict (JSON editado a mano) quedan inactivas y sin secciones
+        self._modelos_activos = [k for k, v in self.config.items()
+                                 if isinstance(v, dict) and v.get('activo', True)]
+        self._excel_cfg = {m: cfg.get('excel') if isinstance(cfg, dict) else None
+                           for m, cfg in self.config.items()}
+        self._pdf_cfg = {m: cfg.get('pdf') if isinstance(cfg, dict) else None
+                         for m, cfg in self.config.items()}
+        self._calculos_cfg = {m: excel.get('calculos') if isinstance(excel, dict) else None
+                              for m, excel in self._excel_cfg.items()}
+        # Validación anticipada: validate_model/validate_all quedan como búsquedas directas
+        self._validaciones: Dict[str, tuple] = {m: self._validar_modelo(m) for m in self.config}
+    
     def get_models(self, activos_solo: bool = True) -> List[str]:
-        """Obtiene lista de modelos disponibles"""
-        if activos_solo:
-            return [k for k, v in self.config.items() if v.get('activo', True)]
-        return list(self.config.keys())
+        """Obtiene lista de modelos disponibles (precalculada en _indexar; no modificar)"""
+        return self._modelos_activos if activos_solo else self._modelos_todos
     
     def get_model_config(self, modelo: str) -> Optional[Dict]:
         """Obtiene la configuración completa de un modelo"""
@@ -34,36 +94,120 @@ class ConfigManager:
     
     def get_excel_config(self, modelo: str) -> Optional[Dict]:
         """Obtiene configuración de Excel para un modelo"""
-        model_cfg = self.get_model_config(modelo)
-        return model_cfg.get('excel') if model_cfg else None
+        return self._excel_cfg.get(modelo)
     
     def get_pdf_config(self, modelo: str) -> Optional[Dict]:
         """Obtiene configuración de PDF para un modelo"""
-        model_cfg = self.get_model_config(modelo)
-        return model_cfg.get('pdf') if model_cfg else None
+        return self._pdf_cfg.get(modelo)
     
     def get_calculos_config(self, modelo: str) -> Optional[Dict]:
         """Obtiene configuración de cálculos"""
-        excel_cfg = self.get_excel_config(modelo)
-        return excel_cfg.get('calculos') if excel_cfg else None
+        return self._calculos_cfg.get(modelo)
+    
+    def save_config(self, config: Optional[Dict] = None) -> bool:
+        """
+        Guarda la configuración en el archivo JSON y actualiza la caché e índices
+        
+        Con config se guarda ese dict en su lugar. Los índices se reconstruyen antes
+        de escribir; si eso o la escritura fallan, la instancia vuelve a la
+        configuración anterior y el archivo no se toca.
+        """
+        anterior = self.config
+        self.config = self.config if config is None else config
+        try:
+            self._indexar()
+            _escribir_json(self.config_path, self.config)
+        except Exception:
+            logger.exception("Error guardando configuración")
+            self.config = anterior
+            self._indexar()
+            return False
+        
+        try:
+            stat = self.config_path.stat()
+            _CONFIG_CACHE[str(self.config_path.resolve())] = (stat.st_mtime_ns, stat.st_size, self.config)
+        except OSError:
+            # Sin stat la entrada anterior queda con otro mtime y se descarta en la próxima carga
+            pass
+        return True
+    
+    def delete_model(self, modelo: str) -> bool:
+        """Elimina un modelo y guarda la configuración"""
+        if modelo not in self.config:
+            return False
+        # Dict nuevo: el anterior puede estar compartido vía _CONFIG_CACHE
+        return self.save_config({k: v for k, v in self.config.items() if k != modelo})
+    
+    def export_model(self, modelo: str, filepath: str) -> bool:
+        """Exporta la configuración de un modelo a un archivo JSON"""
+        model_cfg = self.get_model_config(modelo)
+        if not model_cfg:
+            return False
+        try:
+            _escribir_json(Path(filepath), {modelo: model_cfg})
+            return True
+        except Exception:
+            logger.exception("Error exportando modelo")
+            return False
+    
+    def import_model(self, archivo) -> bool:
+        """Importa modelos desde un JSON (ruta o archivo subido) y guarda la configuración"""
+        try:
+            contenido = archivo.read() if hasattr(archivo, 'read') else Path(archivo).read_bytes()
+            modelos = _json_loads(contenido)
+            if not isinstance(modelos, dict):
+                raise ValueError("el JSON debe ser un objeto {modelo: configuración}")
+            for modelo, model_cfg in modelos.items():
+                if not isinstance(model_cfg, dict):
+                    raise ValueError(f"la configuración del modelo '{modelo}' debe ser un objeto")
+                faltantes = _SECCIONES_REQUERIDAS.difference(model_cfg)
+                if faltantes:
+                    raise ValueError(f"al modelo '{modelo}' le faltan las secciones {sorted(faltantes)}")
+        except Exception:
+            logger.exception("Error importando modelo")
+            return False
+        return self.save_config({**self.config, **modelos})
     
     def validate_model(self, modelo: str) -> tuple:
-        """Valida que un modelo tenga toda la configuración necesaria"""
+        """Valida que un modelo tenga toda la configuración necesaria (precalculado en _indexar)"""
+        validacion = self._validaciones.get(modelo)
+        if validacion is None:
+            return False, [f"Modelo '{modelo}' no encontrado"]
+        return validacion
+    
+    def validate_all(self) -> Dict[str, tuple]:
+        """Retorna {modelo: (es_valido, errores)} para todos los modelos (precalculado en _indexar)"""
+        return self._validaciones
+    
+    def _validar_modelo(self, modelo: str) -> tuple:
+        """Revisa las secciones requeridas de un modelo"""
         errors = []
         model_cfg = self.get_model_config(modelo)
         
         if not model_cfg:
             return False, [f"Modelo '{modelo}' no encontrado"]
+        if not isinstance(model_cfg, dict):
+            return False, [f"La configuración del modelo '{modelo}' no es un objeto"]
         
-        if 'excel' not in model_cfg:
-            errors.append("Falta sección 'excel'")
-        
-        if 'pdf' not in model_cfg:
-            errors.append("Falta sección 'pdf'")
+        faltantes = _SECCIONES_REQUERIDAS.difference(model_cfg)
+        errors.extend(f"Falta sección '{seccion}'" for seccion in sorted(faltantes))
         
         return len(errors) == 0, errors
 
 
+# Una instancia por archivo de configuración para scripts y procesos fuera de Streamlit
+_INSTANCIAS: Dict[str, ConfigManager] = {}
+_INSTANCIAS_LOCK = threading.Lock()
+
+def obtener_config_manager(config_path: str = "config/models.json") -> ConfigManager:
+    """Retorna el ConfigManager compartido del proceso para config_path (se crea la primera vez)"""
+    clave = str(Path(config_path).resolve())
+    with _INSTANCIAS_LOCK:
+        instancia = _INSTANCIAS.get(clave)
+        if instancia is None:
+            instancia = _INSTANCIAS[clave] = ConfigManager(config_path)
+        return instancia
+
 def get_modelo_info(config_manager, modelo: str) -> str:
     """Obtiene información descriptiva de un modelo"""
     model_cfg = config_manager.get_model_config(modelo)
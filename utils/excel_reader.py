@@ -1,45 +1,245 @@
+import logging
+import math
+import os
 import re
+import shutil
+import tempfile
+import unicodedata
+import weakref
+import zipfile
+from collections import defaultdict
+from functools import lru_cache
+from itertools import count
+from pathlib import Path
+import numpy as np
 import pandas as pd
-from typing import Dict, List, Tuple, Optional, Any
+from openpyxl import load_workbook
+from openpyxl.utils.exceptions import InvalidFileException
+from typing import Dict, List, Tuple, Optional, Any, Sequence
+
+logger = logging.getLogger(__name__)
+
+# Motor de lectura: calamine (Rust) si está instalado; None deja que pandas elija (openpyxl/xlrd)
+try:
+    import python_calamine  # noqa: F401
+    EXCEL_ENGINE = 'calamine'
+except ImportError:
+    EXCEL_ENGINE = None
+
+# Patrón precompilado para normalize_header
+_NON_ALNUM = re.compile(r'[^a-z0-9]+')
 
 def normalize_header(h):
     """Normaliza encabezados eliminando acentos y caracteres especiales"""
     if pd.isna(h):
         return ''
-    s = str(h).strip().lower()
-    s = s.replace('ñ', 'n')
-    s = re.sub(r'[áàäâ]', 'a', s)
-    s = re.sub(r'[éèëê]', 'e', s)
-    s = re.sub(r'[íìïî]', 'i', s)
-    s = re.sub(r'[óòöô]', 'o', s)
-    s = re.sub(r'[úùüû]', 'u', s)
-    s = re.sub(r'[^a-z0-9]+', '_', s)
-    s = re.sub(r'^_|_$', '', s)
-    return s
+    return _normalizar_texto(str(h))
+
+@lru_cache(maxsize=4096)
+def _normalizar_texto(texto: str) -> str:
+    """Normalización cacheada: los mismos encabezados se repiten entre archivos y reruns"""
+    s = texto.strip().lower()
+    # NFKD separa las marcas diacríticas (incluida la tilde de la ñ) y ascii las descarta
+    s = unicodedata.normalize('NFKD', s).encode('ascii', 'ignore').decode('ascii')
+    return _NON_ALNUM.sub('_', s).strip('_')
+
+_NUMCLEAN = re.compile(r'[,\s]')
+_NUMERO = re.compile(r'[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?')
 
 def parse_int(value, default=0):
     """Convierte un valor a entero de forma segura"""
-    try:
+    tipo = type(value)
+    if tipo is int:
+        return value
+    if tipo is not str:
         if pd.isna(value):
             return default
         if isinstance(value, (int, float)):
-            return int(value)
-        s = str(value).strip().replace(',', '').replace(' ', '')
-        if s == '':
-            return default
-        return int(float(s))
-    except:
+            return int(value) if math.isfinite(value) else default
+    s = _NUMCLEAN.sub('', str(value))
+    if not _NUMERO.fullmatch(s):
         return default
+    numero = float(s)
+    return int(numero) if math.isfinite(numero) else default
+
+@lru_cache(maxsize=None)
+def _indice_aliases(config: Tuple[Tuple[str, Tuple[str, ...]], ...]):
+    """
+    Construye el índice invertido de aliases para detectar columnas
+    
+    Returns:
+        Tuple con (patrón con todos los aliases, claves por alias, aliases unidos por clave)
+    """
+    claves_por_alias: Dict[str, List[str]] = {}
+    aliases_unidos: Dict[str, str] = {}
+    for clave, aliases in config:
+        if not aliases:
+            continue
+        aliases_lower = [alias.lower() for alias in aliases]
+        for alias in aliases_lower:
+            claves_por_alias.setdefault(alias, []).append(clave)
+        aliases_unidos[clave] = '\x00'.join(aliases_lower)
+    
+    if not claves_por_alias:
+        return None, {}, aliases_unidos
+    
+    # El patrón captura el alias más largo en cada posición; cada alias hereda las
+    # claves de los aliases contenidos en él, así ninguna coincidencia se pierde
+    claves_contenidas = {
+        alias: {clave for otro, claves in claves_por_alias.items() if otro in alias for clave in claves}
+        for alias in claves_por_alias
+    }
+    alternacion = '|'.join(re.escape(a) for a in sorted(claves_por_alias, key=len, reverse=True))
+    patron = re.compile(f'(?=({alternacion}))')
+    return patron, claves_contenidas, aliases_unidos
+
+def _detectar_columnas(cols_lower: Sequence[Tuple[Any, str]],
+                       columnas_config: Dict[str, List[str]]) -> Dict[str, Optional[str]]:
+    """Asigna a cada clave la primera columna que coincide con alguno de sus aliases (una sola pasada)"""
+    config = tuple((clave, tuple(aliases)) for clave, aliases in columnas_config.items())
+    patron, claves_contenidas, aliases_unidos = _indice_aliases(config)
+    
+    encontradas = dict.fromkeys(columnas_config)
+    pendientes = len(aliases_unidos)
+    for col, col_lower in cols_lower:
+        if not pendientes:
+            break
+        # alias dentro de la columna (patrón) o columna dentro de algún alias (texto unido)
+        claves = {clave for clave, unidos in aliases_unidos.items() if col_lower in unidos}
+        if patron is not None:
+            for match in patron.finditer(col_lower):
+                claves.update(claves_contenidas[match.group(1)])
+        for clave in claves:
+            if encontradas[clave] is None:
+                encontradas[clave] = col
+                pendientes -= 1
+    return encontradas
+
+@lru_cache(maxsize=256)
+def _columnas_lower(columnas: Tuple) -> Tuple[Tuple[Any, str], ...]:
+    """Pares (columna, nombre en minúsculas) cacheados: las plantillas repiten encabezados"""
+    return tuple((col, str(col).lower().strip()) for col in columnas)
 
-def find_column(df: pd.DataFrame, aliases: List[str]) -> Optional[str]:
-    """Busca una columna en el DataFrame usando lista de aliases"""
-    cols_lower = {col: str(col).lower().strip() for col in df.columns}
+@lru_cache(maxsize=256)
+def _resolver_columna(cols_lower: Tuple[Tuple[Any, str], ...], aliases: Tuple[str, ...]) -> Optional[str]:
+    """Resolución memoizada: la misma plantilla con los mismos aliases da la misma columna"""
+    return _detectar_columnas(cols_lower, {'columna': list(aliases)})['columna']
+
+def find_column(df: pd.DataFrame, aliases: List[str],
+                cols_lower: Optional[Tuple[Tuple[Any, str], ...]] = None) -> Optional[str]:
+    """
+    Busca una columna en el DataFrame usando lista de aliases
     
-    for col, col_lower in cols_lower.items():
-        for alias in aliases:
-            if alias.lower() in col_lower or col_lower in alias.lower():
-                return col
-    return None
+    Args:
+        df: DataFrame con los datos
+        aliases: Nombres alternativos de la columna
+        cols_lower: Pares (columna, nombre en minúsculas) ya calculados, para reutilizarlos entre llamadas
+    """
+    if cols_lower is None:
+        cols_lower = _columnas_lower(tuple(df.columns))
+    return _resolver_columna(tuple(cols_lower), tuple(aliases))
+
+_HEADER_KEYWORDS = 'pallet|lote|fecha|cantidad|cajas|parte'
+
+def _texto_por_fila(df: pd.DataFrame) -> pd.Series:
+    """Concatena en minúsculas las celdas no vacías de cada fila en una sola pasada"""
+    if df.shape[1] == 0:
+        return pd.Series('', index=df.index, dtype=object)
+    celdas = df.astype(str)
+    validas = df.notna()
+    texto = pd.Series('', index=df.index, dtype=object)
+    hay_texto = pd.Series(False, index=df.index)
+    # Las celdas vacías se omiten, sin dejar separadores dobles entre las demás
+    for i in range(df.shape[1]):
+        valida = validas.iloc[:, i]
+        agregado = texto.where(~hay_texto, texto + ' ') + celdas.iloc[:, i]
+        texto = agregado.where(valida, texto)
+        hay_texto |= valida
+    return texto.str.lower()
+
+def _convertir_celda(valor):
+    """Replica la conversión de pandas: los floats enteros se leen como int"""
+    if type(valor) is float and valor.is_integer():
+        return int(valor)
+    return valor
+
+_HEADER_PATRON = re.compile(_HEADER_KEYWORDS)
+
+def _texto_celdas(fila) -> str:
+    """Texto en minúsculas de una fila, igual que _texto_por_fila (omite las celdas vacías)"""
+    return ' '.join(str(v) for v in fila if v is not None).lower()
+
+def _hoja_openpyxl(wb, hoja_nombre: Optional[str] = None, buscar_en_filas: int = 5,
+                   detener_en: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Recorre una hoja de un workbook openpyxl (read_only) con values_only
+    
+    Con detener_en deja de leer en la primera fila de datos (posterior a la de
+    encabezados, que se busca en las primeras buscar_en_filas) que contiene
+    alguna de las palabras; el resto de la hoja no se descomprime ni se parsea.
+    """
+    ws = wb[hoja_nombre] if hoja_nombre else wb.worksheets[0]
+    filas = ws.iter_rows(values_only=True)
+    
+    def convertir(fila):
+        return tuple(_convertir_celda(v) for v in fila)
+    
+    if not detener_en:
+        return pd.DataFrame([convertir(fila) for fila in filas])
+    
+    detener = re.compile('|'.join(re.escape(palabra.lower()) for palabra in detener_en))
+    
+    # Las primeras filas se leen completas: hasta verlas no se sabe cuál es el encabezado
+    datos = []
+    for fila in filas:
+        datos.append(convertir(fila))
+        if len(datos) >= buscar_en_filas:
+            break
+    textos = [_texto_celdas(fila) for fila in datos]
+    header_row = next((i for i, texto in enumerate(textos) if _HEADER_PATRON.search(texto)), 0)
+    for i in range(header_row + 1, len(datos)):
+        if detener.search(textos[i]):
+            return pd.DataFrame(datos[:i])
+    
+    for fila in filas:
+        fila = convertir(fila)
+        if detener.search(_texto_celdas(fila)):
+            break
+        datos.append(fila)
+    return pd.DataFrame(datos)
+
+def _leer_hoja_cruda(archivo, hoja_nombre: Optional[str] = None, buscar_en_filas: int = 5,
+                     detener_en: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    Lee una hoja sin encabezados
+    
+    Con python-calamine instalado se usa pd.read_excel(engine='calamine'); si no,
+    los .xlsx se recorren con openpyxl en modo read_only/values_only, cortando en
+    la fila de detener_en, y otros formatos (.xls) usan pd.read_excel. Acepta
+    también un pd.ExcelFile ya abierto para no volver a descomprimir el archivo.
+    """
+    if isinstance(archivo, pd.ExcelFile):
+        if archivo.engine == 'openpyxl':
+            return _hoja_openpyxl(archivo.book, hoja_nombre, buscar_en_filas, detener_en)
+        return pd.read_excel(archivo, sheet_name=hoja_nombre or 0, header=None)
+    
+    if hasattr(archivo, 'seek'):
+        archivo.seek(0)
+    if EXCEL_ENGINE:
+        return pd.read_excel(archivo, sheet_name=hoja_nombre or 0, header=None, engine=EXCEL_ENGINE)
+    try:
+        wb = load_workbook(archivo, read_only=True, data_only=True)
+    except (InvalidFileException, zipfile.BadZipFile):
+        if hasattr(archivo, 'seek'):
+            archivo.seek(0)
+        if hoja_nombre:
+            return pd.read_excel(archivo, sheet_name=hoja_nombre, header=None)
+        return pd.read_excel(archivo, header=None)
+    
+    try:
+        return _hoja_openpyxl(wb, hoja_nombre, buscar_en_filas, detener_en)
+    finally:
+        wb.close()
 
 def leer_hoja_excel(archivo, hoja_nombre: Optional[str] = None, 
                     buscar_en_filas: int = 5,
@@ -48,7 +248,7 @@ def leer_hoja_excel(archivo, hoja_nombre: Optional[str] = None,
     Lee una hoja de Excel con detección inteligente de encabezados
     
     Args:
-        archivo: Archivo Excel cargado
+        archivo: Archivo Excel cargado o pd.ExcelFile ya abierto
         hoja_nombre: Nombre de la hoja a leer (None = primera hoja)
         buscar_en_filas: Número de filas donde buscar encabezados
         detener_en: Lista de palabras que indican fin de datos
@@ -58,38 +258,25 @@ def leer_hoja_excel(archivo, hoja_nombre: Optional[str] = None,
     
     # Leer hoja
     try:
-        if hoja_nombre:
-            df = pd.read_excel(archivo, sheet_name=hoja_nombre, header=None)
-        else:
-            df = pd.read_excel(archivo, header=None)
+        df = _leer_hoja_cruda(archivo, hoja_nombre, buscar_en_filas, detener_en)
     except Exception as e:
         raise Exception(f"Error leyendo hoja '{hoja_nombre}': {e}")
     
-    # Buscar fila de encabezados
+    # Buscar fila de encabezados (palabras clave comunes en encabezados)
     header_row = 0
-    for idx in range(min(buscar_en_filas, len(df))):
-        row_str = ' '.join([str(x).lower() for x in df.iloc[idx] if not pd.isna(x)])
-        # Buscar palabras clave comunes en encabezados
-        if any(word in row_str for word in ['pallet', 'lote', 'fecha', 'cantidad', 'cajas', 'parte']):
-            header_row = idx
-            break
+    candidatas = _texto_por_fila(df.iloc[:buscar_en_filas])
+    es_header = candidatas.str.contains(_HEADER_KEYWORDS, regex=True, na=False).to_numpy()
+    if es_header.any():
+        header_row = int(es_header.argmax())
     
     # Limpiar encabezados duplicados/vacíos
     headers = df.iloc[header_row].tolist()
-    clean_headers = []
-    seen_headers = {}
-    
-    for i, h in enumerate(headers):
-        if pd.isna(h) or str(h).strip() == '':
-            clean_headers.append(f'col_vacia_{i}')
-        else:
-            h_str = str(h).strip()
-            if h_str in seen_headers:
-                seen_headers[h_str] += 1
-                clean_headers.append(f"{h_str}_{seen_headers[h_str]}")
-            else:
-                seen_headers[h_str] = 0
-                clean_headers.append(h_str)
+    nombres = [str(h).strip() if not pd.isna(h) else '' for h in headers]
+    nombres = [nombre or f'col_vacia_{i}' for i, nombre in enumerate(nombres)]
+    # Cada nombre lleva su propio contador: la primera aparición queda igual, las demás _1, _2...
+    apariciones = defaultdict(count)
+    clean_headers = [nombre if (n := next(apariciones[nombre])) == 0 else f"{nombre}_{n}"
+                     for nombre in nombres]
     
     # Establecer encabezados y datos
     df.columns = clean_headers
@@ -98,12 +285,12 @@ def leer_hoja_excel(archivo, hoja_nombre: Optional[str] = None,
     # Limpiar filas vacías
     df = df.dropna(how='all')
     
-    # Detener en palabras clave
-    for idx, row in df.iterrows():
-        row_str = ' '.join([str(x).lower() for x in row if not pd.isna(x)])
-        if any(palabra.lower() in row_str for palabra in detener_en):
-            df = df.iloc[:idx]
-            break
+    # Detener en palabras clave (corte por posición, no por etiqueta del índice)
+    if detener_en and len(df):
+        patron = '|'.join(re.escape(palabra.lower()) for palabra in detener_en)
+        detener = _texto_por_fila(df).str.contains(patron, regex=True, na=False).to_numpy()
+        if detener.any():
+            df = df.iloc[:int(detener.argmax())]
     
     return df
 
@@ -119,36 +306,26 @@ def extraer_datos_excel(df: pd.DataFrame, columnas_config: Dict[str, List[str]])
         Tuple con (registros, columnas_encontradas)
     """
     # Encontrar columnas
-    columnas_encontradas = {}
-    for nombre_col, aliases in columnas_config.items():
-        col_encontrada = find_column(df, aliases)
-        columnas_encontradas[nombre_col] = col_encontrada
-    
-    # Extraer registros
-    registros = []
-    
-    for idx, row in df.iterrows():
-        # Verificar que la fila no esté vacía
-        col_pallet = columnas_encontradas.get('numero_pallet')
-        col_cantidad = columnas_encontradas.get('cantidad')
-        
-        if col_pallet and col_cantidad:
-            if pd.isna(row.get(col_pallet)) and pd.isna(row.get(col_cantidad)):
-                continue
-        
-        # Crear registro
-        registro = {}
-        for nombre_col, col_excel in columnas_encontradas.items():
-            if col_excel:
-                val = row.get(col_excel, '')
-                if pd.isna(val) or val == '':
-                    registro[nombre_col] = ''
-                else:
-                    registro[nombre_col] = str(val).strip()
-            else:
-                registro[nombre_col] = ''
-        
-        registros.append(registro)
+    cols_lower = _columnas_lower(tuple(df.columns))
+    columnas_encontradas = _detectar_columnas(cols_lower, columnas_config)
+    
+    # Descartar filas sin pallet ni cantidad
+    col_pallet = columnas_encontradas.get('numero_pallet')
+    col_cantidad = columnas_encontradas.get('cantidad')
+    if col_pallet and col_cantidad:
+        df = df[~(df[col_pallet].isna() & df[col_cantidad].isna())]
+    
+    # Extraer registros columna por columna
+    datos = pd.DataFrame(index=df.index)
+    for nombre_col, col_excel in columnas_encontradas.items():
+        if col_excel:
+            serie = df[col_excel]
+            vacia = serie.isna() | (serie == '')
+            datos[nombre_col] = serie.where(~vacia, '').astype(str).str.strip()
+        else:
+            datos[nombre_col] = ''
+    
+    registros = datos.to_dict(orient='records')
     
     return registros, columnas_encontradas
 
@@ -157,7 +334,7 @@ def leer_hoja_calculos(archivo, hoja_nombre: str, calculos_config: Dict) -> Dict
     Lee la hoja de cálculos (peso, dimensiones) según configuración
     
     Args:
-        archivo: Archivo Excel
+        archivo: Archivo Excel o pd.ExcelFile ya abierto
         hoja_nombre: Nombre de la hoja
         calculos_config: Configuración del método de extracción
     
@@ -171,7 +348,10 @@ def leer_hoja_calculos(archivo, hoja_nombre: str, calculos_config: Dict) -> Dict
     }
     
     try:
-        df = pd.read_excel(archivo, sheet_name=hoja_nombre, header=None)
+        if isinstance(archivo, pd.ExcelFile):
+            df = pd.read_excel(archivo, sheet_name=hoja_nombre, header=None)
+        else:
+            df = pd.read_excel(archivo, sheet_name=hoja_nombre, header=None, engine=EXCEL_ENGINE)
         
         metodo = calculos_config.get('metodo', 'busqueda')
         
@@ -208,43 +388,69 @@ def leer_hoja_calculos(archivo, hoja_nombre: str, calculos_config: Dict) -> Dict
                 if valor:
                     resultado[campo] = valor
         
-    except Exception as e:
-        print(f"⚠️ Error leyendo hoja de cálculos: {e}")
+    except Exception:
+        logger.exception("Error leyendo hoja de cálculos")
     
     return resultado
 
 def buscar_valor_por_keyword(df: pd.DataFrame, keywords: List[str]) -> str:
     """Busca un valor en el DataFrame basado en palabras clave"""
+    if df.empty:
+        return ''
+    
+    # Texto en minúsculas y celdas vacías se calculan una sola vez para todas las palabras clave
+    vacias = df.isna()
+    texto = df.astype(str).where(~vacias, '').apply(lambda s: s.str.lower())
+    valores = df.to_numpy(dtype=object)
+    vacias = vacias.to_numpy()
+    n_filas, n_cols = valores.shape
+    
     for keyword in keywords:
-        for idx, row in df.iterrows():
-            for col_idx, val in enumerate(row):
-                if pd.isna(val):
-                    continue
-                
-                cell = str(val).lower()
-                if keyword.lower() in cell:
-                    # El valor suele estar en la celda siguiente (misma fila, siguiente columna)
-                    try:
-                        if col_idx + 1 < len(row):
-                            siguiente = row.iloc[col_idx + 1]
-                            if not pd.isna(siguiente):
-                                return str(siguiente).strip()
-                    except:
-                        pass
-                    
-                    # O en la fila siguiente, misma columna
-                    try:
-                        if idx + 1 < len(df):
-                            siguiente = df.iloc[idx + 1, col_idx]
-                            if not pd.isna(siguiente):
-                                return str(siguiente).strip()
-                    except:
-                        pass
+        keyword = keyword.lower()
+        coincide = texto.apply(lambda s: s.str.contains(keyword, regex=False)).to_numpy(dtype=bool)
+        # argwhere devuelve las coincidencias fila por fila, en el mismo orden que el recorrido original
+        for fila, col in np.argwhere(coincide & ~vacias):
+            # El valor suele estar en la celda siguiente (misma fila, siguiente columna)
+            if col + 1 < n_cols and not vacias[fila, col + 1]:
+                return str(valores[fila, col + 1]).strip()
+            
+            # O en la fila siguiente, misma columna
+            if fila + 1 < n_filas and not vacias[fila + 1, col]:
+                return str(valores[fila + 1, col]).strip()
     return ''
 
 def obtener_hojas_disponibles(archivo) -> List[str]:
     """Obtiene lista de hojas disponibles en el Excel"""
     try:
-        return pd.ExcelFile(archivo).sheet_names
+        if isinstance(archivo, pd.ExcelFile):
+            return archivo.sheet_names
+        return pd.ExcelFile(archivo, engine=EXCEL_ENGINE).sheet_names
     except:
-        return []
\ No newline at end of file
+        return []
+
+class CopiaTemporal:
+    """
+    Copia en disco de un archivo subido (file-like), copiada en bloques
+    
+    El archivo se elimina con cerrar(), cuando el objeto se libera (al reemplazarlo
+    o al terminar la sesión de Streamlit que lo guarda) o, como último recurso, al
+    salir del proceso.
+    """
+    
+    def __init__(self, archivo):
+        sufijo = Path(getattr(archivo, 'name', '')).suffix or '.xlsx'
+        archivo.seek(0)
+        with tempfile.NamedTemporaryFile(suffix=sufijo, delete=False) as tmp:
+            shutil.copyfileobj(archivo, tmp)
+        self.ruta = tmp.name
+        self._finalizador = weakref.finalize(self, _eliminar_archivo, self.ruta)
+    
+    def cerrar(self):
+        """Elimina el archivo temporal (idempotente)"""
+        self._finalizador()
+
+def _eliminar_archivo(ruta: str):
+    try:
+        os.remove(ruta)
+    except OSError:
+        pass
@@ -1,87 +1,296 @@
 import io
+import math
+import re
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime
+from functools import lru_cache, partial
+import numpy as np
+import pandas as pd
 from reportlab.lib.pagesizes import A4
-from reportlab.platypus import SimpleDocTemplate, Table, TableStyle, Spacer, Paragraph
+from reportlab.platypus import SimpleDocTemplate, Table, LongTable, TableStyle, Spacer, Paragraph, Flowable
 from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
 from reportlab.lib.units import inch
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER
+from .config_manager import obtener_config_manager
+
+# Tabla para str.translate: quita comas y espacios en una sola pasada
+_SIN_SEPARADORES = str.maketrans('', '', ', ')
 
 def parse_float(value, default=0.0):
     """Convierte un valor a float de forma segura"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    s = str(value).strip().translate(_SIN_SEPARADORES)
+    if s == '':
+        return default
     try:
-        if isinstance(value, (int, float)):
-            return float(value)
-        s = str(value).strip().replace(',', '').replace(' ', '')
-        if s == '':
-            return default
         return float(s)
-    except:
+    except (ValueError, TypeError):
         return default
 
+_NUMCLEAN = re.compile(r'[,\s]')
+_NUMERO = re.compile(r'[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?')
+
 def parse_int(value, default=0):
     """Convierte un valor a entero de forma segura"""
-    try:
-        if isinstance(value, (int, float)):
-            return int(value)
-        s = str(value).strip().replace(',', '').replace(' ', '')
-        if s == '':
-            return default
-        return int(float(s))
-    except:
+    if type(value) is int:
+        return value
+    if isinstance(value, (int, float)):
+        return int(value) if math.isfinite(value) else default
+    s = _NUMCLEAN.sub('', str(value))
+    if not _NUMERO.fullmatch(s):
         return default
+    numero = float(s)
+    return int(numero) if math.isfinite(numero) else default
+
+# Campos de los registros que alimentan la tabla de productos
+COLUMNAS_PRODUCTOS = ['numero_pallet', 'cantidad', 'total_cajas', 'n_parte', 'n_lote', 'fecha']
+
+def _columna_entera(df, columna):
+    """Convierte una columna de registros a enteros (0 en celdas vacías o inválidas)"""
+    if columna not in df:
+        return pd.Series(0, index=df.index, dtype='int64')
+    limpia = df[columna].astype(str).str.replace(r'[,\s]', '', regex=True)
+    numeros = pd.to_numeric(limpia, errors='coerce').astype('float64')
+    # Fuera del rango de int64 (incluye ±inf) el cast desbordaría en silencio: cuenta como 0
+    numeros = numeros.where(numeros.abs() < 2.0 ** 63)
+    return numeros.fillna(0).astype('int64')
+
+def calcular_totales(registros):
+    """
+    Calcula en una sola pasada vectorizada los totales de los registros
+    Acepta la lista de registros o un DataFrame ya construido a partir de ella
+    Retorna diccionario con total_piezas, total_cajas y total_pallets
+    """
+    df = registros if isinstance(registros, pd.DataFrame) else pd.DataFrame(registros)
+    
+    if 'numero_pallet' in df:
+        pallets = df['numero_pallet'].dropna().astype(str)
+        total_pallets = int(pallets[pallets != ''].nunique())
+    else:
+        total_pallets = 0
+    
+    return {
+        'total_piezas': int(_columna_entera(df, 'cantidad').sum()),
+        'total_cajas': int(_columna_entera(df, 'total_cajas').sum()),
+        'total_pallets': total_pallets
+    }
+
+def _columna_decimal(df, columna):
+    """Convierte una columna de registros a float (0.0 en celdas vacías o inválidas)"""
+    if columna not in df:
+        return pd.Series(0.0, index=df.index, dtype='float64')
+    limpia = df[columna].astype(str).str.replace(r'[,\s]', '', regex=True)
+    return pd.to_numeric(limpia, errors='coerce').fillna(0.0)
 
 def calcular_pesos_por_pallet(registros):
     """
     Calcula el peso neto y bruto por pallet
-    Suma peso_lote y peso_acumulado para cada pallet único
+    Suma peso_lote y peso_acumulado para cada pallet único (groupby en orden de aparición)
     """
-    pesos_por_pallet = {}
+    df = registros if isinstance(registros, pd.DataFrame) else pd.DataFrame(registros)
+    if 'numero_pallet' not in df:
+        return {}
     
-    for reg in registros:
-        pallet = reg.get('numero_pallet', '')
-        if not pallet:
-            continue
-        
-        peso_lote = parse_float(reg.get('peso_lote', 0))
-        peso_acumulado = parse_float(reg.get('peso_acumulado', 0))
-        
-        if pallet not in pesos_por_pallet:
-            pesos_por_pallet[pallet] = {
-                'peso_neto': 0.0,
-                'peso_bruto': 0.0
-            }
-        
-        pesos_por_pallet[pallet]['peso_neto'] += peso_lote
-        pesos_por_pallet[pallet]['peso_bruto'] += peso_acumulado
+    pallets = df['numero_pallet']
+    con_pallet = pallets.notna() & (pallets != '')
+    pesos = pd.DataFrame({
+        'numero_pallet': pallets,
+        'peso_neto': _columna_decimal(df, 'peso_lote'),
+        'peso_bruto': _columna_decimal(df, 'peso_acumulado'),
+    })[con_pallet]
     
-    return pesos_por_pallet
+    return pesos.groupby('numero_pallet', sort=False).sum().to_dict('index')
 
 def formatear_lista_pesos(pesos_por_pallet):
     """
     Formatea los pesos por pallet en una lista ordenada
-    Retorna dos listas: net_weights y gross_weights
+    Retorna (pallets_ordenados, net_weights, gross_weights, total_peso_neto, total_peso_bruto)
     """
-    # Ordenar pallets numéricamente
-    pallets_ordenados = sorted(pesos_por_pallet.keys(), key=lambda x: int(x) if x.isdigit() else 0)
+    # Ordenar pallets numéricamente (los que no son dígitos cuentan como 0); argsort estable
+    # sobre las claves convertidas una sola vez en lugar de una lambda por elemento
+    pallets = list(pesos_por_pallet)
+    claves = pd.Series(pallets, dtype=object).astype(str)
+    es_numero = claves.str.isdigit().fillna(False).astype(bool)
+    numeros = pd.to_numeric(claves.where(es_numero, '0'))
+    pallets_ordenados = [pallets[i] for i in np.argsort(numeros.to_numpy(), kind='stable')]
     
     net_weights = []
     gross_weights = []
+    total_peso_neto = 0.0
+    total_peso_bruto = 0.0
     
     for pallet in pallets_ordenados:
-        net_weights.append(f"{pesos_por_pallet[pallet]['peso_neto']:.2f}")
-        gross_weights.append(f"{pesos_por_pallet[pallet]['peso_bruto']:.2f}")
+        pesos = pesos_por_pallet[pallet]
+        net_weights.append(f"{pesos['peso_neto']:.2f}")
+        gross_weights.append(f"{pesos['peso_bruto']:.2f}")
+        total_peso_neto += pesos['peso_neto']
+        total_peso_bruto += pesos['peso_bruto']
     
-    return net_weights, gross_weights
+    return pallets_ordenados, net_weights, gross_weights, total_peso_neto, total_peso_bruto
+
+# Estilos (se construyen una sola vez al importar el módulo)
+_AZUL_TITULOS = colors.HexColor('#000080')
+_GRIS_ENCABEZADOS = colors.HexColor('#E0E0E0')
+
+_STYLES = getSampleStyleSheet()
+_TITLE_STYLE = ParagraphStyle('CustomTitle', parent=_STYLES['Heading1'], fontSize=16, 
+                              textColor=_AZUL_TITULOS, alignment=TA_CENTER, 
+                              spaceAfter=6, fontName='Helvetica-Bold')
+_HEADER_STYLE = ParagraphStyle('Header', parent=_STYLES['Normal'], fontSize=8, fontName='Helvetica-Bold')
+_NORMAL_STYLE = ParagraphStyle('CustomNormal', parent=_STYLES['Normal'], fontSize=8, fontName='Helvetica')
+
+_ENCABEZADO_TABLE_STYLE = TableStyle([('ALIGN', (0,0), (-1,-1), 'CENTER')])
+_SHIPPING_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0,0), (-1,-1), 9),
+    ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+    ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+    ('BACKGROUND', (0,0), (-1,0), _GRIS_ENCABEZADOS),
+])
+_TRES_COLUMNAS_TABLE_STYLE = TableStyle([('VALIGN', (0,0), (-1,-1), 'TOP')])
+# Compartido por "Información adicional" y "Transporte"
+_INFO_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0,0), (-1,-1), 8),
+    ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+    ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+    ('BACKGROUND', (0,0), (-1,0), _GRIS_ENCABEZADOS),
+])
+_PRODUCTOS_TABLE_STYLE = TableStyle([
+    ('BACKGROUND', (0,0), (-1,0), _AZUL_TITULOS),
+    ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0,0), (-1,0), 8),
+    ('FONTNAME', (0,1), (-1,-1), 'Helvetica'),
+    ('FONTSIZE', (0,1), (-1,-1), 7),
+    ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+    ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
+    ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+    ('BACKGROUND', (0,1), (0,-1), colors.yellow),
+    ('BACKGROUND', (1,1), (1,-1), colors.yellow),
+    ('BACKGROUND', (2,1), (2,-1), colors.yellow),
+    ('BACKGROUND', (3,1), (3,-1), colors.yellow),
+    ('BACKGROUND', (5,1), (5,-1), colors.yellow),
+    ('BACKGROUND', (6,1), (6,-1), colors.yellow),
+])
+_TOTALES_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
+    ('FONTSIZE', (0,0), (-1,-1), 8),
+    ('ALIGN', (0,0), (-1,-1), 'CENTER'),
+    ('VALIGN', (0,0), (-1,-1), 'TOP'),
+    ('GRID', (0,0), (-1,-1), 0.5, colors.black),
+    ('BACKGROUND', (0,0), (-1,0), _GRIS_ENCABEZADOS),
+])
+_TRANSPORTE_TITULO_TABLE_STYLE = TableStyle([('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'), ('FONTSIZE', (0,0), (-1,0), 9)])
+_FIRMAS_TABLE_STYLE = TableStyle([
+    ('FONTNAME', (0,0), (-1,-1), 'Helvetica'),
+    ('FONTSIZE', (0,0), (-1,-1), 8),
+    ('ALIGN', (0,0), (0,-1), 'LEFT'),
+    ('ALIGN', (2,0), (2,-1), 'RIGHT'),
+])
 
-def generar_pdf_hsps(registros, datos_comercio, config_manager, modelo):
+@lru_cache(maxsize=512)
+def _fragmentos_parrafo(texto, estilo):
+    """Parsea una sola vez el mini-HTML de un párrafo; los textos de encabezado se repiten entre PDFs"""
+    parrafo = Paragraph(texto, estilo)
+    return parrafo.style, parrafo.frags, parrafo.bulletText
+
+def _parrafo(texto, estilo):
+    """Crea un Paragraph nuevo reutilizando los fragmentos ya parseados (como hace ReportLab al dividir)"""
+    style, frags, bullet_text = _fragmentos_parrafo(texto, estilo)
+    return Paragraph(texto, style, bulletText=bullet_text, frags=frags)
+
+class TablaProductosRapida(Flowable):
+    """
+    Tabla de productos dibujada directamente en el canvas
+    
+    Usa anchos de columna y alto de fila fijos, sin el cálculo de layout de Table;
+    el texto que no entra en su columna se recorta y al no caber en la página
+    se divide repitiendo el encabezado.
+    """
+    
+    def __init__(self, headers, filas, col_widths, alto_fila=12):
+        super().__init__()
+        self.headers = headers
+        self.filas = filas
+        self.col_widths = col_widths
+        self.alto_fila = alto_fila
+        self.hAlign = 'CENTER'
+    
+    def wrap(self, availWidth, availHeight):
+        self.width = sum(self.col_widths)
+        self.height = self.alto_fila * (len(self.filas) + 1)
+        return self.width, self.height
+    
+    def split(self, availWidth, availHeight):
+        caben = int(availHeight // self.alto_fila) - 1
+        if caben < 1:
+            return []
+        return [TablaProductosRapida(self.headers, self.filas[:caben], self.col_widths, self.alto_fila),
+                TablaProductosRapida(self.headers, self.filas[caben:], self.col_widths, self.alto_fila)]
+    
+    def draw(self):
+        c = self.canv
+        alto = self.alto_fila
+        xs = [0]
+        for ancho in self.col_widths:
+            xs.append(xs[-1] + ancho)
+        ys = [self.height - alto * i for i in range(len(self.filas) + 2)]
+        y_datos = ys[1]
+        
+        c.saveState()
+        # Fondos: encabezado azul y columnas de datos en amarillo (excepto la descripción)
+        c.setFillColor(_AZUL_TITULOS)
+        c.rect(0, y_datos, self.width, alto, stroke=0, fill=1)
+        c.setFillColor(colors.yellow)
+        for i, ancho in enumerate(self.col_widths):
+            if i != 4 and y_datos > 0:
+                c.rect(xs[i], 0, ancho, y_datos, stroke=0, fill=1)
+        
+        # Textos centrados en cada celda, recortados al ancho de su columna
+        for i, ancho in enumerate(self.col_widths):
+            centro = xs[i] + ancho / 2
+            c.saveState()
+            recorte = c.beginPath()
+            recorte.rect(xs[i], 0, ancho, self.height)
+            c.clipPath(recorte, stroke=0, fill=0)
+            c.setFillColor(colors.whitesmoke)
+            c.setFont('Helvetica-Bold', 8)
+            c.drawCentredString(centro, y_datos + 3.5, self.headers[i])
+            c.setFillColor(colors.black)
+            c.setFont('Helvetica', 7)
+            for y, fila in zip(ys[2:], self.filas):
+                valor = fila[i]
+                # Los registros ya llegan como texto; str() solo para otros tipos
+                c.drawCentredString(centro, y + 3.5, valor if type(valor) is str else str(valor))
+            c.restoreState()
+        
+        c.setStrokeColor(colors.black)
+        c.setLineWidth(0.5)
+        c.grid(xs, ys)
+        c.restoreState()
+
+def generar_pdf_hsps(registros, datos_comercio, config_manager, modelo, tabla_rapida=False, salida=None):
     """
     Genera el PDF en formato HSPS con configuración desde JSON
+    
+    registros puede ser la lista de registros o un DataFrame ya construido a partir
+    de ella; se convierte una sola vez y se reutiliza para pesos, tabla y totales.
+    
+    Con tabla_rapida=True la tabla de productos se dibuja con TablaProductosRapida
+    (más rápido para archivos grandes, sin ajuste automático de celdas).
+    
+    salida: ruta o archivo binario donde escribir el PDF; por defecto un BytesIO
+    (lo que necesita st.download_button). Para generación en lote conviene pasar
+    un archivo en disco y evitar la copia en memoria.
     """
-    buffer = io.BytesIO()
+    # ReportLab arma el PDF completo en memoria y lo escribe con un solo write(),
+    # así que el BytesIO no crece por partes y no hace falta preasignarlo
+    buffer = io.BytesIO() if salida is None else salida
     doc = SimpleDocTemplate(buffer, pagesize=A4, rightMargin=30, leftMargin=30, topMargin=30, bottomMargin=30)
     elementos = []
-    styles = getSampleStyleSheet()
 
     # Obtener configuración del modelo
     pdf_cfg = config_manager.get_pdf_config(modelo)
@@ -93,27 +302,22 @@ def generar_pdf_hsps(registros, datos_comercio, config_manager, modelo):
     bill_to_cfg = pdf_cfg.get('bill_to', {})
     descripcion_producto = pdf_cfg.get('descripcion_producto', 'PRODUCTO')
 
-    # Calcular pesos por pallet
-    pesos_por_pallet = calcular_pesos_por_pallet(registros)
-    net_weights, gross_weights = formatear_lista_pesos(pesos_por_pallet)
+    df_registros = registros if isinstance(registros, pd.DataFrame) else pd.DataFrame(registros)
 
-    # Estilos personalizados
-    title_style = ParagraphStyle('CustomTitle', parent=styles['Heading1'], fontSize=16, 
-                                  textColor=colors.HexColor('#000080'), alignment=TA_CENTER, 
-                                  spaceAfter=6, fontName='Helvetica-Bold')
-    header_style = ParagraphStyle('Header', parent=styles['Normal'], fontSize=8, fontName='Helvetica-Bold')
-    normal_style = ParagraphStyle('CustomNormal', parent=styles['Normal'], fontSize=8, fontName='Helvetica')
+    # Calcular pesos por pallet
+    pesos_por_pallet = calcular_pesos_por_pallet(df_registros)
+    _, net_weights, gross_weights, total_peso_neto, total_peso_bruto = formatear_lista_pesos(pesos_por_pallet)
 
     # ENCABEZADO
     encabezado_data = [
-        [Paragraph("<b>PACKING SLIP</b>", title_style)],
-        [Paragraph(f"<b>{shipper_cfg.get('nombre', 'EMPRESA')}</b>", header_style)],
-        [Paragraph(shipper_cfg.get('direccion', ''), normal_style)],
-        [Paragraph(f"{shipper_cfg.get('ciudad', '')} {shipper_cfg.get('estado', '')}", normal_style)],
-        [Paragraph(shipper_cfg.get('cp', ''), normal_style)]
+        [_parrafo("<b>PACKING SLIP</b>", _TITLE_STYLE)],
+        [_parrafo(f"<b>{shipper_cfg.get('nombre', 'EMPRESA')}</b>", _HEADER_STYLE)],
+        [_parrafo(shipper_cfg.get('direccion', ''), _NORMAL_STYLE)],
+        [_parrafo(f"{shipper_cfg.get('ciudad', '')} {shipper_cfg.get('estado', '')}", _NORMAL_STYLE)],
+        [_parrafo(shipper_cfg.get('cp', ''), _NORMAL_STYLE)]
     ]
     tabla_encabezado = Table(encabezado_data, colWidths=[7*inch])
-    tabla_encabezado.setStyle(TableStyle([('ALIGN', (0,0), (-1,-1), 'CENTER')]))
+    tabla_encabezado.setStyle(_ENCABEZADO_TABLE_STYLE)
     elementos.append(tabla_encabezado)
     elementos.append(Spacer(1, 10))
 
@@ -125,13 +329,7 @@ def generar_pdf_hsps(registros, datos_comercio, config_manager, modelo):
          datos_comercio.get('packing_slip_no', '')]
     ]
     tabla_shipping = Table(shipping_data, colWidths=[1.8*inch, 1.8*inch, 2*inch])
-    tabla_shipping.setStyle(TableStyle([
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0,0), (-1,-1), 9),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#E0E0E0')),
-    ]))
+    tabla_shipping.setStyle(_SHIPPING_TABLE_STYLE)
     elementos.append(tabla_shipping)
     elementos.append(Spacer(1, 8))
 
@@ -155,11 +353,11 @@ TAX ID: {datos_comercio.get('ship_to_tax', ship_to_cfg.get('tax_id', ''))}"""
 {datos_comercio.get('bill_to_city', bill_to_cfg.get('ciudad', ''))}<br/>
 {datos_comercio.get('bill_to_state', bill_to_cfg.get('estado', ''))}"""
 
-    tres_columnas = [[Paragraph(shipper_text, normal_style), 
-                      Paragraph(shipto_text, normal_style), 
-                      Paragraph(billto_text, normal_style)]]
+    tres_columnas = [[_parrafo(shipper_text, _NORMAL_STYLE), 
+                      _parrafo(shipto_text, _NORMAL_STYLE), 
+                      _parrafo(billto_text, _NORMAL_STYLE)]]
     tabla_tres = Table(tres_columnas, colWidths=[2.5*inch, 2.5*inch, 2.5*inch])
-    tabla_tres.setStyle(TableStyle([('VALIGN', (0,0), (-1,-1), 'TOP')]))
+    tabla_tres.setStyle(_TRES_COLUMNAS_TABLE_STYLE)
     elementos.append(tabla_tres)
     elementos.append(Spacer(1, 10))
 
@@ -173,69 +371,36 @@ TAX ID: {datos_comercio.get('ship_to_tax', ship_to_cfg.get('tax_id', ''))}"""
          datos_comercio.get('country_destination', 'Mexico')]
     ]
     tabla_info = Table(info_adicional, colWidths=[1.4*inch]*5)
-    tabla_info.setStyle(TableStyle([
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0,0), (-1,-1), 8),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#E0E0E0')),
-    ]))
+    tabla_info.setStyle(_INFO_TABLE_STYLE)
     elementos.append(tabla_info)
     elementos.append(Spacer(1, 10))
 
     # TABLA DE PRODUCTOS
     headers = ["Pallets No.", "Quantity", "Boxes", "Product No.", "Description", "Lot", "Manufacturing date"]
-    table_data = [headers]
-
-    total_quantity = 0
-    ultimo_pallet = ""
-
-    for reg in registros:
-        pallet_actual = reg.get('numero_pallet', '')
-        pallet_display = pallet_actual if pallet_actual != ultimo_pallet else ''
-        ultimo_pallet = pallet_actual
-        
-        fila = [
-            pallet_display,
-            reg.get('cantidad', ''),
-            reg.get('total_cajas', ''),
-            reg.get('n_parte', ''),
-            descripcion_producto,
-            reg.get('n_lote', ''),
-            reg.get('fecha', '')
-        ]
-        table_data.append(fila)
-        total_quantity += parse_int(reg.get('cantidad', 0))
+    df_productos = df_registros.reindex(columns=COLUMNAS_PRODUCTOS).fillna('')
+    # El número de pallet solo se muestra en la primera fila de cada grupo consecutivo
+    pallets = df_productos['numero_pallet']
+    pallet_display = pallets.where(pallets != pallets.shift(), '')
+    filas_productos = [
+        [pallet, cantidad, cajas, n_parte, descripcion_producto, n_lote, fecha]
+        for pallet, cantidad, cajas, n_parte, n_lote, fecha in zip(
+            pallet_display, df_productos['cantidad'], df_productos['total_cajas'],
+            df_productos['n_parte'], df_productos['n_lote'], df_productos['fecha'])
+    ]
 
     col_widths = [0.8*inch, 0.9*inch, 0.7*inch, 1.2*inch, 2.3*inch, 0.8*inch, 1.3*inch]
-    tabla_productos = Table(table_data, colWidths=col_widths, repeatRows=1)
-    tabla_productos.setStyle(TableStyle([
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#000080')),
-        ('TEXTCOLOR', (0,0), (-1,0), colors.whitesmoke),
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0,0), (-1,0), 8),
-        ('FONTNAME', (0,1), (-1,-1), 'Helvetica'),
-        ('FONTSIZE', (0,1), (-1,-1), 7),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('VALIGN', (0,0), (-1,-1), 'MIDDLE'),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-        ('BACKGROUND', (0,1), (0,-1), colors.yellow),
-        ('BACKGROUND', (1,1), (1,-1), colors.yellow),
-        ('BACKGROUND', (2,1), (2,-1), colors.yellow),
-        ('BACKGROUND', (3,1), (3,-1), colors.yellow),
-        ('BACKGROUND', (5,1), (5,-1), colors.yellow),
-        ('BACKGROUND', (6,1), (6,-1), colors.yellow),
-    ]))
-    elementos.append(tabla_productos)
+    if tabla_rapida:
+        elementos.append(TablaProductosRapida(headers, filas_productos, col_widths))
+    else:
+        # LongTable activa el cálculo optimizado de alturas al dividir entre páginas
+        tabla_productos = LongTable([headers] + filas_productos, colWidths=col_widths, repeatRows=1)
+        tabla_productos.setStyle(_PRODUCTOS_TABLE_STYLE)
+        elementos.append(tabla_productos)
     elementos.append(Spacer(1, 10))
 
     # TOTALES CON PESOS CALCULADOS
-    pallets_unicos = sorted(set(reg.get('numero_pallet', '') for reg in registros if reg.get('numero_pallet')), 
-                           key=lambda x: int(x) if x.isdigit() else 0)
-    
-    # Calcular totales
-    total_peso_neto = sum(pesos_por_pallet[p]['peso_neto'] for p in pallets_unicos)
-    total_peso_bruto = sum(pesos_por_pallet[p]['peso_bruto'] for p in pallets_unicos)
+    totales = calcular_totales(df_registros)
+    total_quantity = totales['total_piezas']
     
     totales_headers = ["Total Pallets", "Dimensions (cm)", "Net weight (Kg)", "Gross weight (Kg)", "Total parts"]
     
@@ -244,30 +409,23 @@ TAX ID: {datos_comercio.get('ship_to_tax', ship_to_cfg.get('tax_id', ''))}"""
     gross_weight_str = '<br/>'.join(gross_weights) + f'<br/><b>TOTAL: {total_peso_bruto:.2f}</b>'
     
     totales_values = [
-        str(len(pallets_unicos)),
+        str(totales['total_pallets']),
         datos_comercio.get('dimensions', '100 X 110 X 109'),
-        Paragraph(net_weight_str, normal_style),
-        Paragraph(gross_weight_str, normal_style),
+        Paragraph(net_weight_str, _NORMAL_STYLE),
+        Paragraph(gross_weight_str, _NORMAL_STYLE),
         str(total_quantity)
     ]
     
     totales_data = [totales_headers, totales_values]
     tabla_totales = Table(totales_data, colWidths=[1.4*inch]*5)
-    tabla_totales.setStyle(TableStyle([
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0,0), (-1,-1), 8),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('VALIGN', (0,0), (-1,-1), 'TOP'),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#E0E0E0')),
-    ]))
+    tabla_totales.setStyle(_TOTALES_TABLE_STYLE)
     elementos.append(tabla_totales)
     elementos.append(Spacer(1, 12))
 
     # TRANSPORTE
     transporte_titulo = [["Información del transporte:"]]
     tabla_transporte_titulo = Table(transporte_titulo, colWidths=[7*inch])
-    tabla_transporte_titulo.setStyle(TableStyle([('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'), ('FONTSIZE', (0,0), (-1,0), 9)]))
+    tabla_transporte_titulo.setStyle(_TRANSPORTE_TITULO_TABLE_STYLE)
     elementos.append(tabla_transporte_titulo)
     elementos.append(Spacer(1, 4))
 
@@ -278,32 +436,50 @@ TAX ID: {datos_comercio.get('ship_to_tax', ship_to_cfg.get('tax_id', ''))}"""
          datos_comercio.get('conductor', '')]
     ]
     tabla_transporte = Table(transporte_data, colWidths=[1.4*inch]*5)
-    tabla_transporte.setStyle(TableStyle([
-        ('FONTNAME', (0,0), (-1,0), 'Helvetica-Bold'),
-        ('FONTSIZE', (0,0), (-1,-1), 8),
-        ('ALIGN', (0,0), (-1,-1), 'CENTER'),
-        ('GRID', (0,0), (-1,-1), 0.5, colors.black),
-        ('BACKGROUND', (0,0), (-1,0), colors.HexColor('#E0E0E0')),
-    ]))
+    tabla_transporte.setStyle(_INFO_TABLE_STYLE)
     elementos.append(tabla_transporte)
     elementos.append(Spacer(1, 15))
 
-    # FIRMAS
+    # FIRMAS (la fecha actual solo se formatea si datos_comercio no la trae)
+    if 'fecha' in datos_comercio:
+        fecha_firma = datos_comercio['fecha']
+    else:
+        hoy = datetime.now()
+        fecha_firma = f"{hoy.day:02d}/{hoy.month:02d}/{hoy.year}"
     firma_data = [
-        ["Firma Conductor:", "", f"Fecha: {datos_comercio.get('fecha', datetime.now().strftime('%d/%m/%Y'))}"],
+        ["Firma Conductor:", "", f"Fecha: {fecha_firma}"],
         ["", "", ""],
         ["Autoriza: Ana Maya", "", "Fecha:"],
         ["Foreign Trade and Logistics Coordinator", "", ""]
     ]
     tabla_firmas = Table(firma_data, colWidths=[2.3*inch, 2.4*inch, 2.3*inch])
-    tabla_firmas.setStyle(TableStyle([
-        ('FONTNAME', (0,0), (-1,-1), 'Helvetica'),
-        ('FONTSIZE', (0,0), (-1,-1), 8),
-        ('ALIGN', (0,0), (0,-1), 'LEFT'),
-        ('ALIGN', (2,0), (2,-1), 'RIGHT'),
-    ]))
+    tabla_firmas.setStyle(_FIRMAS_TABLE_STYLE)
     elementos.append(tabla_firmas)
 
     doc.build(elementos)
-    buffer.seek(0)
-    return buffer
\ No newline at end of file
+    if hasattr(buffer, 'seek'):
+        buffer.seek(0)
+    return buffer
+
+def _generar_pdf_trabajo(trabajo, config_path, tabla_rapida):
+    """Genera un PDF de generar_pdfs_lote dentro del proceso hijo y devuelve sus bytes"""
+    registros, datos_comercio, modelo = trabajo
+    config_manager = obtener_config_manager(config_path)
+    return generar_pdf_hsps(registros, datos_comercio, config_manager, modelo, tabla_rapida).getvalue()
+
+def generar_pdfs_lote(trabajos, config_path="config/models.json", tabla_rapida=False, max_workers=None):
+    """
+    Genera varios PDFs en paralelo, uno por proceso (el layout de ReportLab es CPU y no libera el GIL)
+    
+    Args:
+        trabajos: Lista de tuplas (registros, datos_comercio, modelo)
+        config_path: Archivo de modelos; cada proceso lo carga una vez vía obtener_config_manager
+        tabla_rapida: Igual que en generar_pdf_hsps, aplicado a todos los trabajos
+        max_workers: Procesos a usar (None = número de CPUs)
+    
+    Returns:
+        Lista de buffers BytesIO en el mismo orden que trabajos
+    """
+    trabajo = partial(_generar_pdf_trabajo, config_path=config_path, tabla_rapida=tabla_rapida)
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        return [io.BytesIO(pdf) for pdf in pool.map(trabajo, trabajos)]